@@ -33,6 +33,10 @@ from nuitka.utils.Utils import getOS, isWin32Windows
 
 _main_module = None
 
+# Paths only depend on the main module and the options, so they are computed
+# once only, keyed by function name and arguments.
+_path_cache = {}
+
 
 def setMainModule(main_module):
     """Call this before using other methods of this module."""
@@ -43,46 +47,78 @@ def setMainModule(main_module):
     global _main_module
     _main_module = main_module
 
+    resetOutputDirectoriesCache()
+
+
+def resetOutputDirectoriesCache():
+    """Forget the cached paths, needed when a new build starts."""
+    _path_cache.clear()
+
 
 def getSourceDirectoryPath(onefile=False):
     """Return path inside the build directory."""
 
-    # Distinct build folders for oneline mode.
-    if onefile:
-        suffix = ".onefile-build"
-    else:
-        suffix = ".build"
+    key = ("source", onefile)
 
-    result = Options.getOutputPath(
-        path=os.path.basename(getTreeFilenameWithSuffix(_main_module, suffix))
-    )
+    if key not in _path_cache:
+        # Distinct build folders for oneline mode.
+        if onefile:
+            suffix = ".onefile-build"
+        else:
+            suffix = ".build"
 
+        _path_cache[key] = Options.getOutputPath(
+            path=os.path.basename(getTreeFilenameWithSuffix(_main_module, suffix))
+        )
+
+    result = _path_cache[key]
+
+    # Not cached, the directory might have been removed in the meantime.
     makePath(result)
 
     return result
 
 
 def getStandaloneDirectoryPath():
-    return Options.getOutputPath(
-        path=os.path.basename(getTreeFilenameWithSuffix(_main_module, ".dist"))
-    )
+    key = ("standalone",)
+
+    if key not in _path_cache:
+        _path_cache[key] = Options.getOutputPath(
+            path=os.path.basename(getTreeFilenameWithSuffix(_main_module, ".dist"))
+        )
+
+    return _path_cache[key]
 
 
 def getResultBasepath(onefile=False):
-    if Options.isStandaloneMode() and not onefile:
-        return os.path.join(
-            getStandaloneDirectoryPath(),
-            os.path.basename(getTreeFilenameWithSuffix(_main_module, "")),
-        )
-    else:
-        return Options.getOutputPath(
-            path=os.path.basename(getTreeFilenameWithSuffix(_main_module, ""))
-        )
+    key = ("basepath", onefile)
+
+    if key not in _path_cache:
+        if Options.isStandaloneMode() and not onefile:
+            _path_cache[key] = os.path.join(
+                getStandaloneDirectoryPath(),
+                os.path.basename(getTreeFilenameWithSuffix(_main_module, "")),
+            )
+        else:
+            _path_cache[key] = Options.getOutputPath(
+                path=os.path.basename(getTreeFilenameWithSuffix(_main_module, ""))
+            )
+
+    return _path_cache[key]
 
 
 def getResultFullpath(onefile):
     """Get the final output binary result full path."""
 
+    key = ("fullpath", onefile)
+
+    if key not in _path_cache:
+        _path_cache[key] = _getResultFullpath(onefile=onefile)
+
+    return _path_cache[key]
+
+
+def _getResultFullpath(onefile):
     result = getResultBasepath(onefile=onefile)
 
     if Options.shallMakeModule():
@@ -19,9 +19,12 @@
 
 """
 
-import ctypes
+import errno
+import mmap
 import os
+import struct
 import sys
+from collections import namedtuple
 
 from nuitka import Options, OutputDirectories
 from nuitka.build.DataComposerInterface import getConstantBlobFilename
@@ -36,90 +39,137 @@ from nuitka.utils.FileOperations import (
     getExternalUsePath,
     getFileContents,
     makePath,
-    putTextFileContents,
     removeFileExecutablePermission,
+    withFileLock,
 )
 from nuitka.utils.SharedLibraries import callInstallNameTool
-from nuitka.utils.Utils import getOS, isWin32Windows
+from nuitka.utils.ThreadedExecutor import ThreadPoolExecutor, waitWorkers
+from nuitka.utils.Utils import getCoreCount, getOS, isWin32Windows
 from nuitka.utils.WindowsResources import (
     RT_GROUP_ICON,
     RT_ICON,
     RT_RCDATA,
+    ResourceUpdateSession,
     addResourceToFile,
     addVersionInfoResource,
-    convertStructureToBytes,
     copyResourcesFromFileToFile,
     getDefaultWindowsExecutableManifest,
     getWindowsExecutableManifest,
 )
 
 
-class IconDirectoryHeader(ctypes.Structure):
-    _fields_ = [
-        ("reserved", ctypes.c_short),
-        ("type", ctypes.c_short),
-        ("count", ctypes.c_short),
-    ]
-
-
-class IconDirectoryEntry(ctypes.Structure):
-    _fields_ = [
-        ("width", ctypes.c_char),
-        ("height", ctypes.c_char),
-        ("colors", ctypes.c_char),
-        ("reserved", ctypes.c_char),
-        ("planes", ctypes.c_short),
-        ("bit_count", ctypes.c_short),
-        ("image_size", ctypes.c_int),
-        ("image_offset", ctypes.c_int),
-    ]
-
-
-class IconGroupDirectoryEntry(ctypes.Structure):
-    # Make sure the don't have padding issues.
-    _pack_ = 2
-
-    _fields_ = (
-        ("width", ctypes.c_char),
-        ("height", ctypes.c_char),
-        ("colors", ctypes.c_char),
-        ("reserved", ctypes.c_char),
-        ("planes", ctypes.c_short),
-        ("bit_count", ctypes.c_short),
-        ("image_size", ctypes.c_int),
-        ("id", ctypes.c_short),
-    )
+# Icon files are only ever parsed and the icon group resource written, so
+# plain struct formats are good enough for these.
+_icon_directory_header_struct = struct.Struct("<HHH")
+_icon_directory_entry_struct = struct.Struct("<ccccHHII")
+_icon_group_entry_struct = struct.Struct("<ccccHHIH")
 
+IconDirectoryHeader = namedtuple("IconDirectoryHeader", "reserved type count")
+IconDirectoryEntry = namedtuple(
+    "IconDirectoryEntry",
+    "width height colors reserved planes bit_count image_size image_offset",
+)
 
-def readFromFile(readable, c_struct):
-    """Read ctypes structures from input."""
 
-    result = c_struct()
-    chunk = readable.read(ctypes.sizeof(result))
-    ctypes.memmove(ctypes.byref(result), chunk, ctypes.sizeof(result))
-    return result
+def _convertWithPillow(icon_spec, icon_path, converted_icon_path):
+    from PIL import Image  # pylint: disable=I0021,import-error
 
+    try:
+        image = Image.open(icon_path)
+    except IOError:
+        postprocessing_logger.sysexit(
+            "Unsupported file format for Pillow in '%s', use e.g. PNG files."
+            % icon_spec
+        )
 
-def _addWindowsIconFromIcons(onefile):
-    # Relatively detailed handling, pylint: disable=too-many-locals
+    with image:
+        # Icons can only be written from some modes, e.g. not "CMYK" of
+        # JPEG files, so convert it first.
+        try:
+            image.convert("RGBA").save(
+                converted_icon_path, format="ICO", sizes=_converted_icon_sizes
+            )
+        except (IOError, ValueError) as e:
+            postprocessing_logger.sysexit(
+                "Failed to convert '%s' to Windows icon format with Pillow: %s"
+                % (icon_spec, e)
+            )
 
-    icon_group = 1
-    image_id = 1
-    images = []
 
-    result_filename = OutputDirectories.getResultFullpath(onefile=onefile)
+def _convertWithImageio(icon_spec, icon_path, converted_icon_path):
+    import imageio  # pylint: disable=I0021,import-error
 
-    for icon_spec in Options.getIconPaths():
-        if "#" in icon_spec:
-            icon_path, icon_index = icon_spec.rsplit("#", 1)
-            icon_index = int(icon_index)
+    try:
+        image = imageio.imread(icon_path)
+    except ValueError:
+        postprocessing_logger.sysexit(
+            "Unsupported file format for imageio in '%s', use e.g. PNG files."
+            % icon_spec
+        )
+
+    with imageio.get_writer(converted_icon_path) as writer:
+        writer.append_data(image)
+
+
+def _getImageConverter():
+    """Get the function to use for converting images to icons, if any.
+
+    Pillow writes icons with all sizes directly, and is much faster, so only
+    use imageio if it is not available.
+    """
+    try:
+        from PIL import Image  # pylint: disable=I0021,import-error,unused-import
+    except ImportError:
+        try:
+            import imageio  # pylint: disable=I0021,import-error,unused-import
+        except ImportError:
+            return None
         else:
-            icon_path = icon_spec
-            icon_index = None
+            return _convertWithImageio
+    else:
+        return _convertWithPillow
+
 
-        icon_path = os.path.normcase(icon_path)
+# Sizes included in converted icons, Pillow skips those larger than the image.
+_converted_icon_sizes = ((256, 256), (128, 128), (64, 64), (48, 48), (32, 32), (16, 16))
+
+
+def _convertImageToIcon(count, icon_spec, icon_path, icon_build_path, converter):
+    converted_icon_path = os.path.join(
+        icon_build_path,
+        "icon-%d.ico" % (count + 1),
+    )
+
+    converter(icon_spec, icon_path, converted_icon_path)
+
+    return count, converted_icon_path
+
+
+def _convertNonIcoIcons(icon_specs, onefile):
+    """Convert non-ico icon files, updating their entries in icon_specs."""
+
+    if all(is_ico for _icon_spec, _icon_path, _icon_index, is_ico in icon_specs):
+        return
+
+    icon_build_path = os.path.join(
+        OutputDirectories.getSourceDirectoryPath(onefile=onefile),
+        "icons",
+    )
+
+    makePath(icon_build_path)
+
+    # Determined once, and used for all conversions.
+    image_converter = _getImageConverter()
+
+    # Conversions of non-ico files are independent of one another, do them
+    # all first, in parallel if possible, and put the results in place.
+    with ThreadPoolExecutor(max_workers=min(8, getCoreCount())) as worker_pool:
+        workers = []
+
+        for count, (icon_spec, icon_path, icon_index, is_ico) in enumerate(icon_specs):
+            if is_ico:
+                continue
 
-        if not icon_path.endswith(".ico"):
             postprocessing_logger.info("Not in Windows icon format, converting to it.")
 
             if icon_index is not None:
@@ -128,100 +178,143 @@ def _addWindowsIconFromIcons(onefile):
                     % icon_spec
                 )
 
-            try:
-                import imageio
-            except ImportError:
+            # Checked here, so errors when loading are only about the format.
+            if not os.path.isfile(icon_path):
                 postprocessing_logger.sysexit(
-                    "Need to install 'imageio' to automatically convert non-ico icon file in '%s'."
-                    % icon_spec
+                    "Error, icon file '%s' does not exist." % icon_spec
                 )
 
-            try:
-                image = imageio.imread(icon_path)
-            except ValueError:
+            if image_converter is None:
                 postprocessing_logger.sysexit(
-                    "Unsupported file format for imageio in '%s', use e.g. PNG files."
+                    "Need to install 'Pillow' or 'imageio' to automatically convert non-ico icon file in '%s'."
                     % icon_spec
                 )
 
-            icon_build_path = os.path.join(
-                OutputDirectories.getSourceDirectoryPath(onefile=onefile),
-                "icons",
+            workers.append(
+                worker_pool.submit(
+                    _convertImageToIcon,
+                    count,
+                    icon_spec,
+                    icon_path,
+                    icon_build_path,
+                    image_converter,
+                )
             )
 
-            makePath(icon_build_path)
+        if workers:
+            for count, converted_icon_path in waitWorkers(workers):
+                icon_spec, _icon_path, icon_index, _is_ico = icon_specs[count]
+                icon_specs[count] = icon_spec, converted_icon_path, icon_index, True
 
-            converted_icon_path = os.path.join(
-                icon_build_path,
-                "icon-%d.ico" % image_id,
-            )
 
-            imageio.imwrite(converted_icon_path, image)
-            icon_path = converted_icon_path
+def _addWindowsIconFromIcons(onefile, resource_session):
+    # Relatively detailed handling, pylint: disable=too-many-locals
 
-        with open(icon_path, "rb") as icon_file:
-            # Read header and icon entries.
-            header = readFromFile(icon_file, IconDirectoryHeader)
-            icons = [
-                readFromFile(icon_file, IconDirectoryEntry)
-                for _i in range(header.count)
-            ]
+    icon_paths = Options.getIconPaths()
 
-            if icon_index is not None:
-                if icon_index > len(icons):
-                    postprocessing_logger.sysexit(
-                        "Error, referenced icon index %d in file '%s' with only %d icons."
-                        % (icon_index, icon_path, len(icons))
-                    )
+    # Nothing to do, which is the most common case.
+    if not icon_paths:
+        return
+
+    icon_group = 1
+    image_id = 1
+    images = []
+
+    icon_specs = []
+
+    for icon_spec in icon_paths:
+        if "#" in icon_spec:
+            icon_path, icon_index = icon_spec.rsplit("#", 1)
+            icon_index = int(icon_index)
+        else:
+            icon_path = icon_spec
+            icon_index = None
+
+        icon_specs.append(
+            (icon_spec, icon_path, icon_index, icon_path.lower().endswith(".ico"))
+        )
+
+    _convertNonIcoIcons(icon_specs=icon_specs, onefile=onefile)
 
-                icons[:] = icons[icon_index : icon_index + 1]
+    for icon_spec, icon_path, icon_index, _is_ico in icon_specs:
+        # Icon files are small, read them fully and take the parts from there.
+        icon_data = getFileContents(icon_path, mode="rb")
 
-            postprocessing_logger.info(
-                "Adding %d icon(s) from icon file '%s'." % (len(icons), icon_spec)
+        # Read header and icon entries.
+        header = IconDirectoryHeader._make(
+            _icon_directory_header_struct.unpack_from(icon_data)
+        )
+        icons = [
+            IconDirectoryEntry._make(
+                _icon_directory_entry_struct.unpack_from(
+                    icon_data,
+                    _icon_directory_header_struct.size
+                    + count * _icon_directory_entry_struct.size,
+                )
             )
+            for count in range(header.count)
+        ]
 
-            # Image data are to be scanned from places specified icon entries
-            for icon in icons:
-                icon_file.seek(icon.image_offset, 0)
-                images.append(icon_file.read(icon.image_size))
-
-        parts = [convertStructureToBytes(header)]
-
-        for icon in icons:
-            parts.append(
-                convertStructureToBytes(
-                    IconGroupDirectoryEntry(
-                        width=icon.width,
-                        height=icon.height,
-                        colors=icon.colors,
-                        reserved=icon.reserved,
-                        planes=icon.planes,
-                        bit_count=icon.bit_count,
-                        image_size=icon.image_size,
-                        id=image_id,
-                    )
+        if icon_index is not None:
+            if icon_index > len(icons):
+                postprocessing_logger.sysexit(
+                    "Error, referenced icon index %d in file '%s' with only %d icons."
+                    % (icon_index, icon_path, len(icons))
                 )
+
+            icons[:] = icons[icon_index : icon_index + 1]
+
+        postprocessing_logger.info(
+            "Adding %d icon(s) from icon file '%s'." % (len(icons), icon_spec)
+        )
+
+        # Image data are to be taken from places specified icon entries, the
+        # count is known, so allocate the list for it at once.
+        icon_images = [None] * len(icons)
+
+        for count, icon in enumerate(icons):
+            icon_images[count] = icon_data[
+                icon.image_offset : icon.image_offset + icon.image_size
+            ]
+
+        images.extend(icon_images)
+
+        group_data = bytearray(
+            _icon_directory_header_struct.size
+            + _icon_group_entry_struct.size * len(icons)
+        )
+        _icon_directory_header_struct.pack_into(group_data, 0, *header)
+
+        for count, icon in enumerate(icons):
+            _icon_group_entry_struct.pack_into(
+                group_data,
+                _icon_directory_header_struct.size
+                + count * _icon_group_entry_struct.size,
+                icon.width,
+                icon.height,
+                icon.colors,
+                icon.reserved,
+                icon.planes,
+                icon.bit_count,
+                icon.image_size,
+                image_id,
             )
 
             image_id += 1
 
-        addResourceToFile(
-            target_filename=result_filename,
-            data=b"".join(parts),
+        resource_session.update(
             resource_kind=RT_GROUP_ICON,
-            lang_id=0,
             res_name=icon_group,
-            logger=postprocessing_logger,
+            lang_id=0,
+            data=group_data,
         )
 
     for count, image in enumerate(images, 1):
-        addResourceToFile(
-            target_filename=result_filename,
-            data=image,
+        resource_session.update(
             resource_kind=RT_ICON,
-            lang_id=0,
             res_name=count,
-            logger=postprocessing_logger,
+            lang_id=0,
+            data=image,
         )
 
 
@@ -235,73 +328,116 @@ def executePostProcessingResources(manifest, onefile):
     """
     result_filename = OutputDirectories.getResultFullpath(onefile=onefile)
 
+    # These are used multiple times, only ask once.
+    ask_admin_rights = Options.shallAskForWindowsAdminRights()
+    ask_ui_access_rights = Options.shallAskForWindowsUIAccessRights()
+    version_info_strings = Options.getWindowsVersionInfoStrings()
+    product_version = Options.getWindowsProductVersion()
+    file_version = Options.getWindowsFileVersion()
+
     # TODO: Maybe make these different for onefile and not onefile.
-    if (
-        Options.shallAskForWindowsAdminRights()
-        or Options.shallAskForWindowsUIAccessRights()
-    ):
+    if ask_admin_rights or ask_ui_access_rights:
         if manifest is None:
             manifest = getDefaultWindowsExecutableManifest()
 
-        if Options.shallAskForWindowsAdminRights():
+        if ask_admin_rights:
             manifest.addUacAdmin()
 
-        if Options.shallAskForWindowsUIAccessRights():
+        if ask_ui_access_rights:
             manifest.addUacUiAccess()
 
-    if manifest is not None:
-        manifest.addResourceToFile(result_filename, logger=postprocessing_logger)
-
-    if (
-        Options.getWindowsVersionInfoStrings()
-        or Options.getWindowsProductVersion()
-        or Options.getWindowsFileVersion()
-    ):
-        version_resources.update(
-            addVersionInfoResource(
-                string_values=Options.getWindowsVersionInfoStrings(),
-                product_version=Options.getWindowsProductVersion(),
-                file_version=Options.getWindowsFileVersion(),
-                file_date=(0, 0),
-                is_exe=not Options.shallMakeModule(),
-                result_filename=result_filename,
+    # All resources are added in one go, every resource update rewrites the
+    # binary.
+    with ResourceUpdateSession(
+        result_filename, logger=postprocessing_logger
+    ) as resource_session:
+        if manifest is not None:
+            manifest.addResourceToFile(
+                result_filename,
                 logger=postprocessing_logger,
+                session=resource_session,
             )
-        )
 
-    # Attach icons from template file if given.
-    template_exe = Options.getWindowsIconExecutablePath()
-    if template_exe is not None:
-        res_copied = copyResourcesFromFileToFile(
-            template_exe,
-            target_filename=result_filename,
-            resource_kinds=(RT_ICON, RT_GROUP_ICON),
-        )
+        if version_info_strings or product_version or file_version:
+            version_resources.update(
+                addVersionInfoResource(
+                    string_values=version_info_strings,
+                    product_version=product_version,
+                    file_version=file_version,
+                    file_date=(0, 0),
+                    is_exe=not Options.shallMakeModule(),
+                    result_filename=result_filename,
+                    logger=postprocessing_logger,
+                    session=resource_session,
+                )
+            )
 
-        if res_copied == 0:
-            postprocessing_logger.warning(
-                "The specified icon template executable %r didn't contain anything to copy."
-                % template_exe
+        # Attach icons from template file if given.
+        template_exe = Options.getWindowsIconExecutablePath()
+        if template_exe is not None:
+            res_copied = copyResourcesFromFileToFile(
+                template_exe,
+                target_filename=result_filename,
+                resource_kinds=(RT_ICON, RT_GROUP_ICON),
+                session=resource_session,
             )
+
+            if res_copied == 0:
+                postprocessing_logger.warning(
+                    "The specified icon template executable %r didn't contain anything to copy."
+                    % template_exe
+                )
+            else:
+                postprocessing_logger.warning(
+                    "Copied %d icon resources from %r." % (res_copied, template_exe)
+                )
         else:
-            postprocessing_logger.warning(
-                "Copied %d icon resources from %r." % (res_copied, template_exe)
+            _addWindowsIconFromIcons(onefile=onefile, resource_session=resource_session)
+
+        splash_screen_filename = Options.getWindowsSplashScreen()
+        if splash_screen_filename is not None:
+            splash_data = getFileContents(splash_screen_filename, mode="rb")
+
+            addResourceToFile(
+                target_filename=result_filename,
+                data=splash_data,
+                resource_kind=RT_RCDATA,
+                lang_id=0,
+                res_name=27,
+                logger=postprocessing_logger,
+                session=resource_session,
             )
-    else:
-        _addWindowsIconFromIcons(onefile=onefile)
 
-    splash_screen_filename = Options.getWindowsSplashScreen()
-    if splash_screen_filename is not None:
-        splash_data = getFileContents(splash_screen_filename, mode="rb")
 
-        addResourceToFile(
-            target_filename=result_filename,
-            data=splash_data,
-            resource_kind=RT_RCDATA,
-            lang_id=0,
-            res_name=27,
-            logger=postprocessing_logger,
+def _createUninstalledPythonCmdFile(result_filename):
+    """Create the script that runs the binary with the Python DLL found."""
+
+    dll_directory = getExternalUsePath(os.path.dirname(getTargetPythonDLLPath()))
+
+    cmd_filename = OutputDirectories.getResultRunFilename(onefile=False)
+
+    # Written as bytes with Windows newlines already, no need for text
+    # mode translation.
+    cmd_contents = "\r\n".join(
+        (
+            "@echo off",
+            "rem This script was created by Nuitka to execute '%(exe_filename)s' with Python DLL being found.",
+            "set PATH=%(dll_directory)s;%%PATH%%",
+            '"%%~dp0.\\%(exe_filename)s"',
+            "",
         )
+    ) % {
+        "dll_directory": dll_directory,
+        "exe_filename": os.path.basename(result_filename),
+    }
+
+    # On Python2, this is already bytes.
+    if str is not bytes:
+        cmd_contents = cmd_contents.encode("mbcs")
+
+    with withFileLock("writing file %s" % cmd_filename):
+        with open(cmd_filename, "wb") as cmd_file:
+            cmd_file.write(cmd_contents)
 
 
 def executePostProcessing():
@@ -331,15 +467,23 @@ def executePostProcessing():
 
         source_dir = OutputDirectories.getSourceDirectoryPath()
 
-        # Attach the binary blob as a Windows resource.
-        addResourceToFile(
-            target_filename=result_filename,
-            data=getFileContents(getConstantBlobFilename(source_dir), "rb"),
-            resource_kind=RT_RCDATA,
-            res_name=3,
-            lang_id=0,
-            logger=postprocessing_logger,
-        )
+        # Attach the binary blob as a Windows resource. It can be large, so
+        # map it into memory rather than reading it. Copy on write access is
+        # used, as only writable buffers can be passed without a copy.
+        with open(getConstantBlobFilename(source_dir), "rb") as blob_file:
+            blob_data = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+            try:
+                addResourceToFile(
+                    target_filename=result_filename,
+                    data=blob_data,
+                    resource_kind=RT_RCDATA,
+                    res_name=3,
+                    lang_id=0,
+                    logger=postprocessing_logger,
+                )
+            finally:
+                blob_data.close()
 
     # On macOS, we update the executable path for searching the "libpython"
     # library.
@@ -381,22 +525,12 @@ def executePostProcessing():
             "lib" + os.path.basename(result_filename)[:-4] + ".a",
         )
 
-        if os.path.exists(candidate):
+        # Deleting directly, no need to check for existence first.
+        try:
             os.unlink(candidate)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
 
     if isWin32Windows() and Options.shallTreatUninstalledPython():
-        dll_directory = getExternalUsePath(os.path.dirname(getTargetPythonDLLPath()))
-
-        cmd_filename = OutputDirectories.getResultRunFilename(onefile=False)
-
-        cmd_contents = """
-@echo off
-rem This script was created by Nuitka to execute '%(exe_filename)s' with Python DLL being found.
-set PATH=%(dll_directory)s;%%PATH%%
-"%%~dp0.\\%(exe_filename)s"
-""" % {
-            "dll_directory": dll_directory,
-            "exe_filename": os.path.basename(result_filename),
-        }
-
-        putTextFileContents(cmd_filename, cmd_contents)
+        _createUninstalledPythonCmdFile(result_filename)
@@ -213,7 +213,19 @@ def getRunningPythonDLLPath():
     return dll_path
 
 
+_target_python_dll_path = None
+
+
 def getTargetPythonDLLPath():
+    global _target_python_dll_path  # Cached result, pylint: disable=global-statement
+
+    if _target_python_dll_path is None:
+        _target_python_dll_path = _getTargetPythonDLLPath()
+
+    return _target_python_dll_path
+
+
+def _getTargetPythonDLLPath():
     dll_path = getRunningPythonDLLPath()
 
     from nuitka.Options import isPythonDebug
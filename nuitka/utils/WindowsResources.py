@@ -155,6 +155,8 @@ def getResourcesFromDLL(filename, resource_kinds, with_data=False):
 
 
 def _openFileWindowsResources(filename):
+    import ctypes.wintypes  # Not really redefined, but extended, pylint: disable=redefined-outer-name
+
     fullpath = os.path.abspath(filename)
     if type(filename) is str and str is bytes:
         BeginUpdateResource = ctypes.windll.kernel32.BeginUpdateResourceA
@@ -174,6 +176,8 @@ def _openFileWindowsResources(filename):
 
 
 def _closeFileWindowsResources(update_handle):
+    import ctypes.wintypes  # Not really redefined, but extended, pylint: disable=redefined-outer-name
+
     EndUpdateResource = ctypes.windll.kernel32.EndUpdateResourceA
     EndUpdateResource.argtypes = [ctypes.wintypes.HANDLE, ctypes.wintypes.BOOL]
     EndUpdateResource.restype = ctypes.wintypes.BOOL
@@ -185,12 +189,17 @@ def _closeFileWindowsResources(update_handle):
 
 
 def _updateWindowsResource(update_handle, resource_kind, res_name, lang_id, data):
+    import ctypes.wintypes  # Not really redefined, but extended, pylint: disable=redefined-outer-name
+
     if data is None:
         size = 0
     else:
         size = len(data)
 
-        assert type(data) is bytes
+        # Other buffers, e.g. "bytearray" or "mmap" are passed without making
+        # a copy of them, these must be writable buffers.
+        if type(data) is not bytes:
+            data = (ctypes.c_char * size).from_buffer(data)
 
     UpdateResourceA = ctypes.windll.kernel32.UpdateResourceA
 
@@ -203,7 +212,14 @@ def _updateWindowsResource(update_handle, resource_kind, res_name, lang_id, data
         ctypes.wintypes.DWORD,
     ]
 
-    ret = UpdateResourceA(update_handle, resource_kind, res_name, lang_id, data, size)
+    try:
+        ret = UpdateResourceA(
+            update_handle, resource_kind, res_name, lang_id, data, size
+        )
+    finally:
+        # Release the buffer export now, a traceback would keep it alive and
+        # then e.g. closing the "mmap" fails and hides the actual error.
+        del data
 
     if not ret:
         raise ctypes.WinError()
@@ -218,13 +234,16 @@ def deleteWindowsResources(filename, resource_kind, res_names):
     _closeFileWindowsResources(update_handle)
 
 
-def copyResourcesFromFileToFile(source_filename, target_filename, resource_kinds):
+def copyResourcesFromFileToFile(
+    source_filename, target_filename, resource_kinds, session=None
+):
     """Copy resources from one file to another.
 
     Args:
         source_filename - filename where the resources are taken from
         target_filename - filename where the resources are added to
         resource_kinds - tuple of numeric values indicating types of resources
+        session - ResourceUpdateSession for the target to add the resources to
 
     Returns:
         int - amount of resources copied, in case you want report
@@ -240,7 +259,10 @@ def copyResourcesFromFileToFile(source_filename, target_filename, resource_kinds
     )
 
     if res_data:
-        update_handle = _openFileWindowsResources(target_filename)
+        if session is not None:
+            session.checkTargetFilename(target_filename)
+        else:
+            update_handle = _openFileWindowsResources(target_filename)
 
         for resource_kind, res_name, lang_id, data in res_data:
             assert resource_kind in resource_kinds
@@ -248,22 +270,29 @@ def copyResourcesFromFileToFile(source_filename, target_filename, resource_kinds
             # Not seeing the point at this time really, but seems to cause troubles otherwise.
             lang_id = 0
 
-            _updateWindowsResource(
-                update_handle, resource_kind, res_name, lang_id, data
-            )
+            if session is not None:
+                session.update(resource_kind, res_name, lang_id, data)
+            else:
+                _updateWindowsResource(
+                    update_handle, resource_kind, res_name, lang_id, data
+                )
 
-        _closeFileWindowsResources(update_handle)
+        if session is None:
+            _closeFileWindowsResources(update_handle)
 
     return len(res_data)
 
 
-def addResourceToFile(target_filename, data, resource_kind, lang_id, res_name, logger):
+def _addResourcesToFile(target_filename, resources, logger):
     max_attempts = 5
 
     for attempt in range(1, max_attempts + 1):
         update_handle = _openFileWindowsResources(target_filename)
 
-        _updateWindowsResource(update_handle, resource_kind, res_name, lang_id, data)
+        for resource_kind, res_name, lang_id, data in resources:
+            _updateWindowsResource(
+                update_handle, resource_kind, res_name, lang_id, data
+            )
 
         try:
             _closeFileWindowsResources(update_handle)
@@ -295,11 +324,62 @@ Disable Anti-Virus, e.g. Windows Defender for build folders. Retrying after a se
         logger.sysexit("Failed to update resources, the result is unusable.")
 
 
+class ResourceUpdateSession(object):
+    """Resource updates to be committed to a file all at once.
+
+    Every resource update rewrites the whole binary, so doing them in one
+    update session is much faster than adding them one by one. Use it as
+    a context manager, nothing is written if the block is left with an
+    exception.
+    """
+
+    def __init__(self, target_filename, logger):
+        self.target_filename = target_filename
+        self.logger = logger
+
+        self.resources = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None and self.resources:
+            _addResourcesToFile(
+                target_filename=self.target_filename,
+                resources=self.resources,
+                logger=self.logger,
+            )
+
+        return False
+
+    def checkTargetFilename(self, target_filename):
+        assert os.path.abspath(target_filename) == os.path.abspath(
+            self.target_filename
+        ), (target_filename, self.target_filename)
+
+    def update(self, resource_kind, res_name, lang_id, data):
+        self.resources.append((resource_kind, res_name, lang_id, data))
+
+
+def addResourceToFile(
+    target_filename, data, resource_kind, lang_id, res_name, logger, session=None
+):
+    if session is not None:
+        session.checkTargetFilename(target_filename)
+        session.update(resource_kind, res_name, lang_id, data)
+    else:
+        _addResourcesToFile(
+            target_filename=target_filename,
+            resources=((resource_kind, res_name, lang_id, data),),
+            logger=logger,
+        )
+
+
 class WindowsExecutableManifest(object):
     def __init__(self, template):
         self.tree = TreeXML.fromString(template)
 
-    def addResourceToFile(self, filename, logger):
+    def addResourceToFile(self, filename, logger, session=None):
         addResourceToFile(
             target_filename=filename,
             data=TreeXML.toBytes(self.tree),
@@ -307,6 +387,7 @@ class WindowsExecutableManifest(object):
             res_name=1,
             lang_id=0,
             logger=logger,
+            session=session,
         )
 
     def addUacAdmin(self):
@@ -595,6 +676,7 @@ def addVersionInfoResource(
     is_exe,
     result_filename,
     logger,
+    session=None,
 ):
     if product_version is None:
         product_version = file_version
@@ -643,6 +725,7 @@ def addVersionInfoResource(
         res_name=1,
         lang_id=0,
         logger=logger,
+        session=session,
     )
 
     return string_values